@@ -1,5 +1,5 @@
-import os
 import io
+import os
 import sys
 import uuid
 import time
@@ -8,14 +8,28 @@ import tempfile
 import traceback
 import logging
 import gc
+import contextlib
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
+from urllib.parse import quote
 
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Request, render_template, request, jsonify, send_file
 from werkzeug.middleware.proxy_fix import ProxyFix
 import fitz  # PyMuPDF
-from PIL import Image
+import numpy as np
 import pikepdf
 
+import page_render
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows — Waitress runs a single process there
+
 # Fix Windows console encoding
 if sys.platform == 'win32':
     try:
@@ -32,7 +46,41 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Write size for uploads streamed to disk (the form parser hands over 64 KB
+# pieces; they're coalesced into large sequential writes)
+UPLOAD_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+class _UploadFile(io.BufferedRandom):
+    """Upload written straight to its job's input file, SHA-1 hashed on the way in."""
+
+    def __init__(self, path):
+        super().__init__(io.FileIO(path, 'w+'), buffer_size=UPLOAD_BLOCK_SIZE)
+        self.sha1 = hashlib.sha1()
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(self.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+    def write(self, data):
+        self.sha1.update(data)
+        return super().write(data)
+
+
+class _UploadRequest(Request):
+    """
+    Request that streams its first file part to upload_path, if set before
+    request.files is read, instead of spooling it to a temp file first.
+    """
+    upload_path = None
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.upload_path is None:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        path, self.upload_path = self.upload_path, None
+        return _UploadFile(path)
+
+
 app = Flask(__name__)
+app.request_class = _UploadRequest
 app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1)
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max upload
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0  # No caching for static files
@@ -42,6 +90,106 @@ UPLOAD_DIR = os.path.join(tempfile.gettempdir(), 'athyna_compressor')
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 logger.info(f'Temp directory: {UPLOAD_DIR}')
 
+# Processes per render pool. gunicorn.conf.py splits the cores between
+# concurrent requests; a single-process server gets all of them.
+RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS', os.cpu_count()))
+
+# Render pools never fork the serving process — it is multi-threaded
+# (gunicorn gthread, the cache reaper) and a forked child can deadlock on a
+# lock another thread held at fork time.
+RENDER_MP_CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+if RENDER_MP_CONTEXT.get_start_method() == 'forkserver':
+    # Workers fork from a server that has already imported the (Flask-free)
+    # render module, instead of each importing PyMuPDF and numpy. The server
+    # finds it via the working directory, which gunicorn sets to this one.
+    RENDER_MP_CONTEXT.set_forkserver_preload(['page_render'])
+
+# Documents up to this many pages are rendered in the request's own process:
+# starting a pool costs more than it saves on them
+INLINE_RENDER_PAGES = 4
+
+# Raw page renders kept for the same-DPI quality retry. They go to RAM-backed
+# /dev/shm, and only when the whole document's render fits the budget —
+# otherwise the (uncommon) retry just re-renders.
+PIXMAP_CACHE_ROOT = '/dev/shm'
+PIXMAP_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# When served behind nginx, set X_ACCEL_REDIRECT_PREFIX (e.g. /protected/)
+# so downloads are handed to nginx and sent with sendfile(2):
+#     location /protected/ { internal; alias /tmp/athyna_compressor/; }
+# Unset (Waitress/gunicorn only), downloads go through send_file.
+X_ACCEL_REDIRECT_PREFIX = os.environ.get('X_ACCEL_REDIRECT_PREFIX')
+
+# Rendered page JPEGs, keyed by upload hash + DPI + quality + page. The
+# quality comes from the size model, so this only helps identical
+# re-submissions (same file, same target) — the 5 MB and 10 MB targets pick
+# different qualities and don't share entries. Every attempt's pages are
+# written, so it is off unless JPEG_CACHE_MAX_MB is set; the reaper keeps it
+# under that size (oldest first) and drops files older than the max age.
+JPEG_CACHE_DIR = os.path.join(UPLOAD_DIR, 'cache')
+JPEG_CACHE_MAX_BYTES = int(os.environ.get('JPEG_CACHE_MAX_MB', 0)) * 1024 * 1024
+JPEG_CACHE_MAX_AGE = int(os.environ.get('JPEG_CACHE_MAX_AGE_HOURS', 6)) * 3600
+if JPEG_CACHE_MAX_BYTES:
+    os.makedirs(JPEG_CACHE_DIR, exist_ok=True)
+
+
+def _reap_jpeg_cache():
+    """
+    Periodically delete cached page JPEGs older than JPEG_CACHE_MAX_AGE,
+    then the oldest of the rest until the cache fits JPEG_CACHE_MAX_BYTES.
+    """
+    while True:
+        cutoff = time.time() - JPEG_CACHE_MAX_AGE
+        kept = []
+        try:
+            with os.scandir(JPEG_CACHE_DIR) as entries:
+                for entry in entries:
+                    try:
+                        stat = entry.stat()
+                        if stat.st_mtime < cutoff:
+                            os.remove(entry.path)
+                        else:
+                            kept.append((stat.st_mtime, stat.st_size, entry.path))
+                    except OSError:
+                        pass
+        except OSError:
+            pass  # cache dir removed (e.g. /tmp cleanup) — writers recreate it
+
+        total = sum(size for _, size, _ in kept)
+        for _, size, path in sorted(kept):
+            if total <= JPEG_CACHE_MAX_BYTES:
+                break
+            with contextlib.suppress(OSError):
+                os.remove(path)
+            total -= size
+        time.sleep(60)
+
+
+def _start_jpeg_cache_reaper():
+    """
+    Start the reaper thread, unless another process already runs it. Every
+    gunicorn worker imports this module; an exclusive lock on a file in
+    UPLOAD_DIR picks one of them (and is released if that worker dies).
+    """
+    global _reaper_lock
+    if fcntl is not None:
+        _reaper_lock = open(os.path.join(UPLOAD_DIR, 'cache-reaper.lock'), 'w')
+        try:
+            fcntl.flock(_reaper_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            _reaper_lock.close()
+            _reaper_lock = None
+            return
+    threading.Thread(target=_reap_jpeg_cache, name='jpeg-cache-reaper', daemon=True).start()
+
+
+_reaper_lock = None
+
+# Only serving processes reap — not the render pool's workers
+if JPEG_CACHE_MAX_BYTES and multiprocessing.parent_process() is None:
+    _start_jpeg_cache_reaper()
+
 
 # ============================================================
 # Error handlers — catch everything
@@ -87,11 +235,12 @@ def favicon():
 # ============================================================
 # Compression Engine
 # ============================================================
-def compress_pdf(input_path, output_path, target_mb):
+def compress_pdf(input_path, output_path, target_mb, file_hash=None):
     """
     Compress a PDF to a target file size in MB.
     Strategy: render pages as images, recompress with adaptive
-    JPEG quality, rebuild PDF, apply pikepdf optimizations.
+    JPEG quality, rebuild PDF with structure-level optimizations.
+    file_hash (hex digest of the upload) enables the page JPEG cache.
     """
     target_bytes = target_mb * 1024 * 1024
     original_size = os.path.getsize(input_path)
@@ -107,67 +256,81 @@ def compress_pdf(input_path, output_path, target_mb):
             'ratio': 0
         }
 
+    # Open once and reuse across every attempt — each open re-parses the
+    # xref table and page tree
     doc = fitz.open(input_path)
-    num_pages = len(doc)
-    doc.close()
-    logger.info(f'PDF has {num_pages} pages')
-
-    # Iterative compression: try progressively lower DPI until target is met
-    dpi_steps = [150, 120, 100, 85, 72]
-
-    # For aggressive targets, start lower
-    if target_mb <= 5:
-        if num_pages > 50:
-            dpi_steps = [85, 72, 60]
-        elif num_pages > 20:
-            dpi_steps = [120, 100, 85, 72]
-
-    temp_pdf_path = output_path + '.temp.pdf'
-    final_size = original_size
-
-    for attempt, dpi in enumerate(dpi_steps):
-        doc = fitz.open(input_path)
-        logger.info(f'Attempt {attempt+1}: DPI={dpi}')
-
-        # Phase 1: Find optimal JPEG quality for this DPI
-        best_quality = _find_optimal_quality(doc, dpi, target_bytes, num_pages)
-        logger.info(f'  Quality={best_quality}')
+    executor = None
+    try:
+        num_pages = len(doc)
+        logger.info(f'PDF has {num_pages} pages')
+
+        # One render pool for every attempt; each worker opens the input
+        # once in its initializer and keeps it until the pool shuts down.
+        # Small documents, or a single render process, render inline instead.
+        render_workers = min(RENDER_WORKERS, num_pages)
+        if render_workers > 1 and num_pages > INLINE_RENDER_PAGES:
+            executor = ProcessPoolExecutor(max_workers=render_workers,
+                                           mp_context=RENDER_MP_CONTEXT,
+                                           initializer=page_render.init_worker,
+                                           initargs=(input_path,))
+
+        # Iterative compression: try progressively lower DPI until target is met
+        dpi_steps = [150, 120, 100, 85, 72]
+
+        # For aggressive targets, start lower
+        if target_mb <= 5:
+            if num_pages > 50:
+                dpi_steps = [85, 72, 60]
+            elif num_pages > 20:
+                dpi_steps = [120, 100, 85, 72]
+
+        final_size = original_size
+
+        page_area = sum(page.rect.get_area() for page in doc)
+
+        for attempt, dpi in enumerate(dpi_steps):
+            # Rendered pages are cached in RAM for this DPI only (if they fit),
+            # so the quality-only retry below re-encodes instead of re-rendering
+            with _pixmap_cache_dir(page_area, dpi) as pixmap_cache:
+                logger.info(f'Attempt {attempt+1}: DPI={dpi}')
+
+                # Phase 1: Find optimal JPEG quality for this DPI
+                best_quality = _find_optimal_quality(doc, dpi, target_bytes, num_pages)
+                logger.info(f'  Quality={best_quality}')
+
+                # Phase 2: Build compressed, optimized PDF
+                _build_compressed_pdf(doc, executor, output_path, dpi, best_quality,
+                                      pixmap_cache=pixmap_cache, file_hash=file_hash)
+                gc.collect()
 
-        # Phase 2: Build compressed PDF
-        _build_compressed_pdf(doc, temp_pdf_path, dpi, best_quality)
+                final_size = os.path.getsize(output_path)
+                logger.info(f'  Result: {final_size / (1024*1024):.1f}MB')
+
+                if final_size <= target_bytes:
+                    logger.info(f'  Target reached!')
+                    break
+
+                # If close (within 30%), try one more shot with lower quality at same DPI
+                if final_size <= target_bytes * 1.3:
+                    ratio = target_bytes / final_size
+                    adjusted_quality = max(15, int(best_quality * ratio * 0.85))
+                    logger.info(f'  Close! Retrying with quality={adjusted_quality}')
+                    _build_compressed_pdf(doc, executor, output_path, dpi, adjusted_quality,
+                                          pixmap_cache=pixmap_cache, file_hash=file_hash)
+                    gc.collect()
+                    final_size = os.path.getsize(output_path)
+                    logger.info(f'  Retry result: {final_size / (1024*1024):.1f}MB')
+                    if final_size <= target_bytes:
+                        logger.info(f'  Target reached on retry!')
+                        break
+
+        # Linearize once, for the result we keep — not on every attempt
+        final_size = _linearize_pdf(output_path, target_bytes)
+    finally:
+        if executor is not None:
+            executor.shutdown()
         doc.close()
-        gc.collect()
-
-        # Phase 3: pikepdf optimization
-        _optimize_with_pikepdf(temp_pdf_path, output_path)
-
-        if os.path.exists(temp_pdf_path):
-            os.remove(temp_pdf_path)
-
-        final_size = os.path.getsize(output_path)
-        logger.info(f'  Result: {final_size / (1024*1024):.1f}MB')
-
-        if final_size <= target_bytes:
-            logger.info(f'  Target reached!')
-            break
-
-        # If close (within 30%), try one more shot with lower quality at same DPI
-        if final_size <= target_bytes * 1.3:
-            ratio = target_bytes / final_size
-            adjusted_quality = max(15, int(best_quality * ratio * 0.85))
-            logger.info(f'  Close! Retrying with quality={adjusted_quality}')
-            doc = fitz.open(input_path)
-            _build_compressed_pdf(doc, temp_pdf_path, dpi, adjusted_quality)
-            doc.close()
-            gc.collect()
-            _optimize_with_pikepdf(temp_pdf_path, output_path)
-            if os.path.exists(temp_pdf_path):
-                os.remove(temp_pdf_path)
-            final_size = os.path.getsize(output_path)
-            logger.info(f'  Retry result: {final_size / (1024*1024):.1f}MB')
-            if final_size <= target_bytes:
-                logger.info(f'  Target reached on retry!')
-                break
+        fitz.TOOLS.store_shrink(100)
 
     compressed_mb = round(final_size / (1024 * 1024), 2)
     original_mb = round(original_size / (1024 * 1024), 2)
@@ -186,116 +349,139 @@ def compress_pdf(input_path, output_path, target_mb):
     }
 
 
-def _find_optimal_quality(doc, dpi, target_bytes, num_pages):
-    """Binary search for optimal JPEG quality."""
-    low, high = 20, 85
-    best_quality = 50
+def _pixmap_cache_dir(page_area, dpi):
+    """
+    Temp directory context for raw page renders at this DPI, or a null
+    context (yielding None) if they wouldn't fit the RAM budget.
+    """
+    if os.path.isdir(PIXMAP_CACHE_ROOT):
+        raw_bytes = page_area * (dpi / 72) ** 2 * 3
+        budget = min(PIXMAP_CACHE_MAX_BYTES, shutil.disk_usage(PIXMAP_CACHE_ROOT).free // 2)
+        if raw_bytes <= budget:
+            return tempfile.TemporaryDirectory(dir=PIXMAP_CACHE_ROOT)
+    return contextlib.nullcontext()
+
 
+# JPEG quality range, and the two qualities the size model is fitted from
+MIN_QUALITY, MAX_QUALITY = 20, 85
+PROBE_LOW, PROBE_HIGH = 30, 75
+
+
+def _sample_indices(num_pages):
+    """Up to 5 page indices spread evenly through the document."""
     sample_pages = min(5, num_pages)
-    sample_indices = [int(i * num_pages / sample_pages) for i in range(sample_pages)]
-
-    for iteration in range(6):
-        mid = (low + high) // 2
-        estimated_total = 0
-
-        for idx in sample_indices:
-            page = doc[idx]
-            mat = fitz.Matrix(dpi / 72, dpi / 72)
-            pix = page.get_pixmap(matrix=mat)
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            del pix  # free pixmap immediately
-
-            buf = io.BytesIO()
-            img.save(buf, format='JPEG', quality=mid, optimize=True)
-            page_size = buf.tell()
-            estimated_total += page_size
-            buf.close()
-            del img  # free image immediately
+    return [int(i * num_pages / sample_pages) for i in range(sample_pages)]
 
-        gc.collect()
 
-        avg_page_size = estimated_total / sample_pages
-        projected_total = avg_page_size * num_pages * 1.08
+def _solve_quality(size_low, size_high, scale, target_bytes):
+    """
+    Fit size ~ slope * q + intercept through the sample sizes at PROBE_LOW
+    and PROBE_HIGH, scale to the whole document and solve for the target.
+    """
+    slope = (size_high - size_low) / (PROBE_HIGH - PROBE_LOW)
+    intercept = size_low - slope * PROBE_LOW
+    if slope <= 0:
+        # Size doesn't grow with quality (e.g. blank pages) — nothing to trade off
+        return MAX_QUALITY if intercept * scale <= target_bytes else MIN_QUALITY
+
+    quality = (target_bytes / scale - intercept) / slope
+    return int(max(MIN_QUALITY, min(MAX_QUALITY, quality)))
+
+
+def _find_optimal_quality(doc, dpi, target_bytes, num_pages):
+    """Pick the JPEG quality for a target size from a linear size-vs-quality model."""
+    sample_indices = _sample_indices(num_pages)
+
+    # Render each sample page once and encode it at both probe qualities
+    size_low = 0
+    size_high = 0
+    for idx in sample_indices:
+        page = doc[idx]
+        pix = page.get_pixmap(dpi=dpi, alpha=False, colorspace=fitz.csRGB)
+        # Zero-copy view of MuPDF's pixel buffer — pix must outlive arr
+        arr = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.width, 3)
+
+        size_low += len(page_render.encode_jpeg(arr, PROBE_LOW, fastdct=True))
+        size_high += len(page_render.encode_jpeg(arr, PROBE_HIGH, fastdct=True))
+        del arr, pix  # free pixel buffer only after encoding
+        fitz.TOOLS.store_shrink(100)
+
+    gc.collect()
+
+    scale = num_pages / len(sample_indices) * 1.08
+    return _solve_quality(size_low, size_high, scale, target_bytes)
 
-        if projected_total <= target_bytes:
-            best_quality = mid
-            low = mid + 1
-        else:
-            high = mid - 1
 
-    return best_quality
+# Pages inserted into the output doc between MuPDF store flushes in the
+# main process. (This PyMuPDF can't report the store's size, so the flush
+# is driven by page count.)
+STORE_FLUSH_PAGES = 32
 
 
-def _build_compressed_pdf(doc, output_path, dpi, quality):
-    """Build a new PDF with compressed page images — memory-efficient batched approach."""
+def _build_compressed_pdf(doc, executor, output_path, dpi, quality,
+                          pixmap_cache=None, file_hash=None):
+    """
+    Build a new PDF with compressed page images in a single output document.
+    executor is a render pool set up with page_render.init_worker for this
+    doc, or None to render in this process.
+    pixmap_cache is an optional (RAM-backed) directory of raw page renders
+    at this DPI, filled on the first call and reused by later calls; file_hash enables
+    the persistent page JPEG cache.
+    """
     num_pages = len(doc)
-    batch_size = 5  # Process 5 pages at a time to limit peak RAM
-    batch_files = []
+    out_doc = fitz.open()
+    jpeg_cache_prefix = os.path.join(JPEG_CACHE_DIR, file_hash) if file_hash else None
 
     try:
-        for batch_start in range(0, num_pages, batch_size):
-            batch_end = min(batch_start + batch_size, num_pages)
-            batch_doc = fitz.open()
-
-            for page_num in range(batch_start, batch_end):
-                page = doc[page_num]
-                mat = fitz.Matrix(dpi / 72, dpi / 72)
-                pix = page.get_pixmap(matrix=mat)
-                img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-                del pix  # free pixmap immediately
-
-                img_buf = io.BytesIO()
-                img.save(img_buf, format='JPEG', quality=quality, optimize=True, subsampling=2)
-                img_buf.seek(0)
-
-                rect = page.rect
-                new_page = batch_doc.new_page(width=rect.width, height=rect.height)
-                new_page.insert_image(rect, stream=img_buf.read())
-                img_buf.close()
-                del img  # free image immediately
-
-            # Save batch to disk and free memory
-            batch_path = output_path + f'.batch{batch_start}.pdf'
-            batch_doc.save(batch_path, garbage=4, deflate=True)
-            batch_doc.close()
-            batch_files.append(batch_path)
-            gc.collect()
-            logger.info(f'  Batch {batch_start}-{batch_end-1} saved to disk')
-
-        # Merge all batches using pikepdf (memory efficient)
-        if len(batch_files) == 1:
-            shutil.move(batch_files[0], output_path)
+        if executor is None:
+            results = map(page_render.render_page_jpeg, repeat(doc), range(num_pages), repeat(dpi),
+                          repeat(quality), repeat(pixmap_cache), repeat(jpeg_cache_prefix))
         else:
-            merger = pikepdf.Pdf.new()
-            for bf in batch_files:
-                src = pikepdf.open(bf)
-                merger.pages.extend(src.pages)
-                src.close()
-                gc.collect()
-            merger.save(output_path, linearize=True)
-            merger.close()
-            gc.collect()
+            # Pages are rendered in parallel by worker processes and streamed
+            # back in order; the main process only inserts the finished JPEGs.
+            results = executor.map(
+                page_render.render_worker_page,
+                range(num_pages),
+                repeat(dpi),
+                repeat(quality),
+                repeat(pixmap_cache),
+                repeat(jpeg_cache_prefix),
+                chunksize=2,
+            )
+        for page_num, (width, height, jpeg_bytes) in enumerate(results, 1):
+            new_page = out_doc.new_page(width=width, height=height)
+            new_page.insert_image(new_page.rect, stream=jpeg_bytes)
+            if page_num % STORE_FLUSH_PAGES == 0:
+                fitz.TOOLS.store_shrink(100)
+
+        logger.info(f'  {num_pages} pages assembled')
+        out_doc.save(output_path, garbage=4, deflate=True, use_objstms=1)
+
+    finally:
+        out_doc.close()
+        gc.collect()
+
 
+def _linearize_pdf(path, target_bytes):
+    """
+    Linearize a PDF (fast web view) in place and return its final size.
+    Skipped if the hint tables would push the file over the target, or
+    make an already over-target file any bigger.
+    """
+    size = os.path.getsize(path)
+    linear_path = path + '.linear.pdf'
+    try:
+        with pikepdf.open(path) as pdf:
+            pdf.save(linear_path, linearize=True)
+
+        linear_size = os.path.getsize(linear_path)
+        if linear_size <= max(size, target_bytes):
+            os.replace(linear_path, path)
+            return linear_size
+        return size
     finally:
-        # Clean up batch files
-        for bf in batch_files:
-            try:
-                if os.path.exists(bf):
-                    os.remove(bf)
-            except Exception:
-                pass
-
-
-def _optimize_with_pikepdf(input_path, output_path):
-    """Apply pikepdf structure-level optimizations."""
-    with pikepdf.open(input_path) as pdf:
-        pdf.save(
-            output_path,
-            linearize=True,
-            object_stream_mode=pikepdf.ObjectStreamMode.generate,
-            compress_streams=True,
-            recompress_flate=True
-        )
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(linear_path)
 
 
 # ============================================================
@@ -307,6 +493,12 @@ def compress():
     logger.info(f'=== /compress request received === Method: {request.method}, URL: {request.url}')
 
     try:
+        # The form parser writes the upload straight to input_path
+        job_id = str(uuid.uuid4())[:8]
+        input_path = os.path.join(UPLOAD_DIR, f'{job_id}_original.pdf')
+        output_path = os.path.join(UPLOAD_DIR, f'{job_id}_compressed.pdf')
+        request.upload_path = input_path
+
         if 'file' not in request.files:
             logger.error('No file in request')
             return jsonify({'error': 'No file uploaded'}), 400
@@ -316,6 +508,10 @@ def compress():
             logger.error('Empty filename')
             return jsonify({'error': 'No file selected'}), 400
 
+        if not isinstance(file.stream, _UploadFile):
+            logger.error('Upload is not the first file part')
+            return jsonify({'error': 'Upload a single PDF file'}), 400
+
         if not file.filename.lower().endswith('.pdf'):
             logger.error(f'Not a PDF: {file.filename}')
             return jsonify({'error': 'Only PDF files are supported'}), 400
@@ -324,20 +520,19 @@ def compress():
         if target_mb not in (5, 10):
             return jsonify({'error': 'Target must be 5 or 10 MB'}), 400
 
-        # Save uploaded file
-        job_id = str(uuid.uuid4())[:8]
         original_name = Path(file.filename).stem
-        input_path = os.path.join(UPLOAD_DIR, f'{job_id}_original.pdf')
         output_filename = f'{original_name}_compressed.pdf'
-        output_path = os.path.join(UPLOAD_DIR, f'{job_id}_compressed.pdf')
 
-        logger.info(f'Saving upload: {file.filename} ({target_mb}MB target) -> job {job_id}')
-        file.save(input_path)
+        # Already on disk — flush the last block and keep the hash, which
+        # lets the page JPEG cache (if enabled) recognise repeat uploads
+        file.stream.close()
+        file_hash = file.stream.sha1.hexdigest() if JPEG_CACHE_MAX_BYTES else None
         file_size = os.path.getsize(input_path)
-        logger.info(f'Upload saved: {file_size / (1024*1024):.1f}MB at {input_path}')
+        logger.info(f'Upload saved: {file.filename} ({file_size / (1024*1024):.1f}MB, '
+                    f'{target_mb}MB target) -> job {job_id}')
 
         # Run compression
-        result = compress_pdf(input_path, output_path, target_mb)
+        result = compress_pdf(input_path, output_path, target_mb, file_hash=file_hash)
         result['download_id'] = job_id
         result['filename'] = output_filename
         logger.info(f'Done! Result: {result}')
@@ -348,8 +543,10 @@ def compress():
         return jsonify({'error': f'Compression failed: {str(e)}'}), 500
 
     finally:
-        # Clean up original
+        # Clean up original (closing the upload first — Windows can't
+        # delete a file that's still open)
         try:
+            request.close()
             if 'input_path' in locals() and os.path.exists(input_path):
                 os.remove(input_path)
         except Exception:
@@ -364,7 +561,14 @@ def download(job_id):
         return jsonify({'error': 'File not found or expired'}), 404
 
     filename = request.args.get('filename', 'compressed.pdf')
-    return send_file(filepath, as_attachment=True, download_name=filename)
+    if X_ACCEL_REDIRECT_PREFIX:
+        # Let the front proxy stream the file from disk
+        response = app.response_class(status=200, mimetype='application/pdf')
+        response.headers['X-Accel-Redirect'] = f'{X_ACCEL_REDIRECT_PREFIX.rstrip("/")}/{job_id}_compressed.pdf'
+        response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(filename)}"
+        return response
+
+    return send_file(filepath, as_attachment=True, download_name=filename, conditional=True)
 
 
 if __name__ == '__main__':
@@ -373,9 +577,16 @@ if __name__ == '__main__':
     print("  " + "-" * 24)
     print(f"  Running at: http://localhost:{port}\n")
 
-    # Use Waitress — a production WSGI server that handles large
-    # file uploads reliably (Flask's dev server crashes on large uploads)
-    from waitress import serve
-    serve(app, host='0.0.0.0', port=port, channel_timeout=300,
-          recv_bytes=262144, max_request_body_size=104857600)
+    if sys.platform == 'win32':
+        # Use Waitress on Windows, where gunicorn doesn't run — it handles
+        # large file uploads reliably (Flask's dev server crashes on them)
+        from waitress import serve
+        serve(app, host='0.0.0.0', port=port, channel_timeout=300,
+              recv_bytes=1048576, max_request_body_size=104857600)
+    else:
+        # Same multi-process gunicorn setup as production (gunicorn.conf.py)
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        os.execvp('gunicorn', ['gunicorn', '--chdir', base_dir,
+                               '--config', os.path.join(base_dir, 'gunicorn.conf.py'),
+                               '--bind', f'0.0.0.0:{port}', 'app:app'])
 
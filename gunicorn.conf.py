@@ -0,0 +1,21 @@
+# Gunicorn settings, picked up automatically from the working directory.
+# A few worker processes so concurrent compressions run in parallel instead
+# of queueing behind each other.
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = 'gthread'
+# One request at a time per worker: each compression runs its own render
+# pool, and a second thread would either share that worker's cores or
+# oversubscribe the host
+threads = 1
+timeout = 300  # large PDFs can take minutes to compress
+
+# Every in-flight compression starts its own render pool (app.RENDER_WORKERS
+# processes); with one request per worker, splitting the cores across the
+# workers caps the total at the core count. Set in the master, inherited by
+# the workers.
+os.environ.setdefault('RENDER_WORKERS',
+                      str(max(1, multiprocessing.cpu_count() // workers)))
@@ -0,0 +1,107 @@
+# Page rendering and JPEG encoding, shared by the Flask app and its render
+# pool. Kept free of Flask and app configuration so pool workers only import
+# PyMuPDF, numpy and the encoder.
+import os
+import contextlib
+
+import fitz  # PyMuPDF
+import numpy as np
+
+try:
+    import simplejpeg  # libjpeg-turbo bindings, preferred encoder
+except ImportError:
+    simplejpeg = None  # fall back to MuPDF's built-in JPEG encoder
+
+
+def encode_jpeg(arr, quality, fastdct=False):
+    """
+    JPEG-encode an RGB array (h, w, 3) — 4:2:0 chroma subsampling with
+    simplejpeg. MuPDF's fallback encoder can only write 4:4:4, so its
+    pages come out noticeably bigger (~1.7x) at the same quality.
+    fastdct trades a little accuracy for speed — fine for size probes,
+    not for pages that ship; the fallback ignores it.
+    """
+    if simplejpeg is not None:
+        return simplejpeg.encode_jpeg(arr, quality=quality, colorsubsampling='420', fastdct=fastdct)
+
+    height, width = arr.shape[:2]
+    pix = fitz.Pixmap(fitz.csRGB, width, height, arr.tobytes(), False)
+    return pix.tobytes(output='jpg', jpg_quality=quality)
+
+
+def render_page_jpeg(doc, page_num, dpi, quality, cache_dir=None, jpeg_cache_prefix=None):
+    """
+    Render one page of doc to JPEG, returns (w, h, jpeg_bytes).
+    If cache_dir is given, the raw RGB render is stored there (or reused
+    from there) so a later call at the same DPI only re-encodes.
+    If jpeg_cache_prefix is given (cache dir + upload hash), finished JPEGs
+    are looked up in / written to the page JPEG cache so repeat uploads of
+    the same PDF skip both steps.
+    """
+    page = doc[page_num]
+    rect = page.rect
+
+    jpeg_cache_file = None
+    if jpeg_cache_prefix:
+        jpeg_cache_file = f'{jpeg_cache_prefix}_{dpi}_{quality}_{page_num}.jpg'
+        try:
+            with open(jpeg_cache_file, 'rb') as f:
+                return rect.width, rect.height, f.read()
+        except OSError:
+            pass  # cache miss (or reaped meanwhile) — render below
+
+    cache_file = os.path.join(cache_dir, f'{page_num}.npy') if cache_dir else None
+    pix = None
+    if cache_file and os.path.exists(cache_file):
+        arr = np.load(cache_file, mmap_mode='r')  # mmap-backed, no render needed
+    else:
+        pix = page.get_pixmap(dpi=dpi, alpha=False, colorspace=fitz.csRGB)
+        # Zero-copy view of MuPDF's pixel buffer — pix must outlive arr
+        arr = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.width, 3)
+        if cache_file:
+            # Best effort, written then renamed so a failed write is never
+            # read back; the retry re-renders any page that's missing
+            tmp_path = f'{cache_file}.{os.getpid()}.tmp.npy'
+            try:
+                np.save(tmp_path, arr)
+                os.replace(tmp_path, cache_file)
+            except OSError:
+                with contextlib.suppress(OSError):
+                    os.remove(tmp_path)
+
+    jpeg_bytes = encode_jpeg(arr, quality)
+    del arr, pix  # free pixel buffer only after encoding
+
+    fitz.TOOLS.store_shrink(100)  # keep MuPDF's store bounded per process
+
+    if jpeg_cache_file:
+        # Write then rename, so concurrent readers never see a partial file.
+        # Best effort — a failed cache write must not fail the page.
+        tmp_path = f'{jpeg_cache_file}.{os.getpid()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(jpeg_cache_file), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(jpeg_bytes)
+            os.replace(tmp_path, jpeg_cache_file)
+        except OSError:
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+
+    return rect.width, rect.height, jpeg_bytes
+
+
+# The input document as opened by a render pool worker, so each worker
+# parses the PDF once for the whole compression rather than once per page.
+# Released when the worker process exits with the pool.
+_worker_doc = None
+
+
+def init_worker(input_path):
+    """Pool initializer: open the input PDF once in this worker process."""
+    global _worker_doc
+    _worker_doc = fitz.open(input_path)
+
+
+def render_worker_page(page_num, dpi, quality, cache_dir=None, jpeg_cache_prefix=None):
+    """render_page_jpeg on the worker's own copy of the input — runs in the pool."""
+    return render_page_jpeg(_worker_doc, page_num, dpi, quality, cache_dir, jpeg_cache_prefix)